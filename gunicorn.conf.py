@@ -0,0 +1,11 @@
+bind = '0.0.0.0:4000'
+
+# Threaded workers: handlers spend most of their time waiting on Neon,
+# Spotify, or sendfile, so threads give concurrency without extra processes
+# each holding their own DB pool and download executor.
+worker_class = 'gthread'
+workers = 2
+threads = 8
+
+# Keep client connections open between range requests while streaming
+keepalive = 30
@@ -1,5 +1,8 @@
+import hmac
+import json
 import os
 import re
+import stat
 import uuid
 import time
 import threading
@@ -7,12 +10,16 @@ import logging
 import psycopg2
 import requests
 import base64
+from requests.adapters import HTTPAdapter
 from psycopg2 import pool
-from psycopg2.extras import DictCursor
-from flask import Flask, request, jsonify, send_file, Response, abort, g
+from psycopg2.extras import DictCursor, execute_values
+from flask import Flask, request, jsonify, send_file, abort, g, Response, stream_with_context
 from flask_cors import CORS
 from mutagen.oggopus import OggOpus as Opus
 import yt_dlp
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from functools import wraps
 from pydantic import SecretStr, ValidationError
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -51,9 +58,19 @@ app = Flask(__name__)
 CORS(app)
 
 MUSIC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'music')
+# Cached files are named "<uuid4 hex>.opus" (dashed uuids for files cached
+# before the switch to .hex); anything else is rejected before touching the
+# filesystem.
+_FILENAME_RE = re.compile(r'^[0-9a-f]{32}\.opus$|^[0-9a-f-]{36}\.opus$')
 TOKEN_ENDPOINT = 'https://accounts.spotify.com/api/token'
 NOW_PLAYING_ENDPOINT = 'https://api.spotify.com/v1/me/player/currently-playing'
 
+# Shared session keeps persistent connections to the Spotify hosts, saving a
+# TCP+TLS handshake per request. (connect, read) timeouts in seconds.
+SPOTIFY_TIMEOUT = (3, 5)
+spotify_session = requests.Session()
+spotify_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=1))
+
 # Constants for cache size management (in bytes)
 CACHE_LIMIT_BYTES = 3 * 1024 * 1024 * 1024  # 3 GB
 CACHE_TARGET_BYTES = 2.5 * 1024 * 1024 * 1024 # Target 2.5 GB after cleanup
@@ -61,24 +78,80 @@ CACHE_TARGET_BYTES = 2.5 * 1024 * 1024 * 1024 # Target 2.5 GB after cleanup
 # Global lock to prevent multiple cleanup processes from running simultaneously
 cleanup_lock = threading.Lock()
 
+# Bounded pool for background work (downloads, cleanup, access-time updates).
+# Caps thread count so background jobs cannot exhaust the DB connection pool.
+background_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='bg')
+
+# Buffer of pending last_accessed_at updates, flushed periodically in one
+# batched UPDATE instead of one round-trip per stream request.
+ACCESS_FLUSH_INTERVAL_SECONDS = 5
+_access_buf_lock = threading.Lock()
+_access_buf = {}
+
 try:
-    db_connection_pool = psycopg2.pool.SimpleConnectionPool(minconn=1, maxconn=10, dsn=settings.NEON_CONNECTION_STRING)
+    # ThreadedConnectionPool: SimpleConnectionPool is not safe to share across
+    # the request handlers and background workers that all call getconn().
+    db_connection_pool = psycopg2.pool.ThreadedConnectionPool(
+        minconn=2, maxconn=16, dsn=settings.NEON_CONNECTION_STRING,
+        keepalives=1, keepalives_idle=30)
     logging.info("Database connection pool created successfully.")
 except psycopg2.OperationalError as err:
     logging.critical(f"FATAL: Error creating database connection pool: {err}")
     exit(1)
 
-def get_db_connection():
-    return db_connection_pool.getconn()
+@contextmanager
+def db_conn():
+    """Check a connection out of the pool, returning it on every exit path."""
+    conn = db_connection_pool.getconn()
+    try:
+        yield conn
+    finally:
+        db_connection_pool.putconn(conn)
 
-def return_db_connection(conn):
-    db_connection_pool.putconn(conn)
+def ensure_schema():
+    """Apply small, idempotent schema upgrades the app depends on."""
+    with db_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("ALTER TABLE tracks ADD COLUMN IF NOT EXISTS size_bytes BIGINT")
+        # Partial covering index so the eviction scan (WHERE status='cached'
+        # ORDER BY last_accessed_at) is an index-only range scan, not a sort.
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS tracks_cached_lru_idx
+            ON tracks (last_accessed_at) INCLUDE (file_name, size_bytes)
+            WHERE status = 'cached'
+        """)
+        # Single-row running total of cached bytes, maintained on download and
+        # eviction so cleanup never has to sum or scan anything. Seeded from
+        # the tracks table the first time it is created.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                total_bytes BIGINT NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO cache_stats (id, total_bytes)
+            SELECT 1, COALESCE(SUM(size_bytes), 0) FROM tracks WHERE status = 'cached'
+            ON CONFLICT (id) DO NOTHING
+        """)
+        conn.commit()
+        cursor.close()
+
+try:
+    ensure_schema()
+    logging.info("Database schema verified.")
+except psycopg2.Error as err:
+    logging.critical(f"FATAL: Error verifying database schema: {err}")
+    exit(1)
+
+# Extracted once: get_secret_value() builds a new string on every call
+_API_KEY_BYTES = settings.API_KEY.get_secret_value().encode()
 
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         api_key = request.headers.get('X-API-Key') or request.args.get('apiKey')
-        if not api_key or api_key != settings.API_KEY.get_secret_value():
+        if not api_key or not hmac.compare_digest(api_key.encode(), _API_KEY_BYTES):
             abort(401, description="Unauthorized: Invalid or missing API Key.")
         return f(*args, **kwargs)
     return decorated_function
@@ -89,8 +162,11 @@ def start_request_logging():
     request_id = request.headers.get('X-Request-Id') or str(uuid.uuid4())
     g.request_id = request_id
     logging.info(f"[{request_id}] IN  {request.method} {request.path} from={request.remote_addr} args={dict(request.args)}")
-    if request.is_json and request.get_data(as_text=True):
-        logging.info(f"[{request_id}] IN  payload={request.get_json(silent=True)}")
+    # Payload logging is debug-only: parsing the body just to log it costs a
+    # full read+decode per JSON request. cache=True lets the handler reuse
+    # the parsed result instead of parsing again.
+    if request.is_json and logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"[{request_id}] IN  payload={request.get_json(silent=True, cache=True)}")
 
 @app.after_request
 def end_request_logging(response):
@@ -104,17 +180,54 @@ def end_request_logging(response):
 # ==============================================================================
 # --- 3. HELPER AND BACKGROUND FUNCTIONS ---
 # ==============================================================================
+# Spotify access tokens last ~an hour; cache the current one and only hit the
+# token endpoint when it is close to expiring.
+_spotify_token = {'value': None, 'expires_at': 0}
+_spotify_token_lock = threading.Lock()
+
 def get_spotify_access_token():
-    client_id = settings.SPOTIFY_CLIENT_ID
-    client_secret = settings.SPOTIFY_CLIENT_SECRET.get_secret_value()
-    refresh_token = settings.SPOTIFY_REFRESH_TOKEN.get_secret_value()
-    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-    response = requests.post(TOKEN_ENDPOINT,
-        headers={'Authorization': f'Basic {auth_header}', 'Content-Type': 'application/x-www-form-urlencoded'},
-        data={'grant_type': 'refresh_token', 'refresh_token': refresh_token}
-    )
-    response.raise_for_status()
-    return response.json()['access_token']
+    with _spotify_token_lock:
+        if time.time() < _spotify_token['expires_at'] - 60:
+            return _spotify_token['value']
+        client_id = settings.SPOTIFY_CLIENT_ID
+        client_secret = settings.SPOTIFY_CLIENT_SECRET.get_secret_value()
+        refresh_token = settings.SPOTIFY_REFRESH_TOKEN.get_secret_value()
+        auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+        response = spotify_session.post(TOKEN_ENDPOINT,
+            headers={'Authorization': f'Basic {auth_header}', 'Content-Type': 'application/x-www-form-urlencoded'},
+            data={'grant_type': 'refresh_token', 'refresh_token': refresh_token},
+            timeout=SPOTIFY_TIMEOUT
+        )
+        response.raise_for_status()
+        payload = response.json()
+        _spotify_token['value'] = payload['access_token']
+        _spotify_token['expires_at'] = time.time() + payload.get('expires_in', 3600)
+        return _spotify_token['value']
+
+def flush_access_times():
+    """Write buffered last_accessed_at timestamps in a single batched UPDATE."""
+    with _access_buf_lock:
+        if not _access_buf:
+            return
+        pending = list(_access_buf.items())
+        _access_buf.clear()
+    try:
+        with db_conn() as conn:
+            cursor = conn.cursor()
+            execute_values(cursor,
+                "UPDATE tracks SET last_accessed_at = v.ts FROM (VALUES %s) AS v(file_name, ts) WHERE tracks.file_name = v.file_name",
+                pending, template="(%s, %s::timestamptz)")
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        logging.error(f"Error flushing access times for {len(pending)} tracks: {e}")
+
+def access_time_flusher():
+    while True:
+        time.sleep(ACCESS_FLUSH_INTERVAL_SECONDS)
+        flush_access_times()
+
+threading.Thread(target=access_time_flusher, daemon=True, name='access-flusher').start()
 
 def cleanup_cache():
     if not cleanup_lock.acquire(blocking=False):
@@ -123,50 +236,59 @@ def cleanup_cache():
 
     logging.info("CLEANUP: Starting cache cleanup check.")
     try:
-        total_size = sum(os.path.getsize(os.path.join(MUSIC_DIRECTORY, f)) for f in os.listdir(MUSIC_DIRECTORY) if os.path.isfile(os.path.join(MUSIC_DIRECTORY, f)))
-        
-        if total_size <= CACHE_LIMIT_BYTES:
-            logging.info(f"CLEANUP: Cache size is {total_size / (1024**3):.2f} GB. No cleanup needed.")
-            return
-
-        logging.warning(f"CLEANUP: Cache size {total_size / (1024**3):.2f} GB exceeds limit of {CACHE_LIMIT_BYTES / (1024**3):.2f} GB. Starting cleanup.")
-        
-        bytes_to_delete = total_size - CACHE_TARGET_BYTES
-        deleted_bytes_total = 0
-        deleted_files_count = 0
-
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT file_name FROM tracks WHERE status = 'cached' ORDER BY last_accessed_at ASC")
-        tracks_to_delete = cursor.fetchall()
-
-        for track in tracks_to_delete:
-            if deleted_bytes_total >= bytes_to_delete:
-                break
-
-            file_name = track['file_name']
-            if not file_name: continue
-
-            file_path = os.path.join(MUSIC_DIRECTORY, file_name)
-            if os.path.exists(file_path):
-                try:
-                    file_size = os.path.getsize(file_path)
-                    os.remove(file_path)
-                    
-                    delete_cursor = conn.cursor()
-                    delete_cursor.execute("DELETE FROM tracks WHERE file_name = %s", (file_name,))
-                    conn.commit()
-                    delete_cursor.close()
+        with db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+
+            # The running total is maintained on every download and eviction,
+            # so the size check is a single-row read.
+            cursor.execute("SELECT total_bytes FROM cache_stats")
+            total_size = cursor.fetchone()['total_bytes']
+
+            if total_size <= CACHE_LIMIT_BYTES:
+                logging.info(f"CLEANUP: Cache size is {total_size / (1024**3):.2f} GB. No cleanup needed.")
+                cursor.close()
+                return
+
+            logging.warning(f"CLEANUP: Cache size {total_size / (1024**3):.2f} GB exceeds limit of {CACHE_LIMIT_BYTES / (1024**3):.2f} GB. Starting cleanup.")
+
+            bytes_to_delete = total_size - CACHE_TARGET_BYTES
+            deleted_bytes_total = 0
+
+            # Server-side cursor: stream eviction candidates instead of pulling
+            # every cached row into memory before breaking out of the loop.
+            evict_cursor = conn.cursor(name='evict_cur', cursor_factory=DictCursor)
+            evict_cursor.itersize = 256
+            evict_cursor.execute("SELECT file_name, size_bytes FROM tracks WHERE status = 'cached' ORDER BY last_accessed_at ASC")
+
+            deleted_names = []
+            for track in evict_cursor:
+                if deleted_bytes_total >= bytes_to_delete:
+                    break
+
+                file_name = track['file_name']
+                if not file_name: continue
+
+                file_path = os.path.join(MUSIC_DIRECTORY, file_name)
+                if os.path.exists(file_path):
+                    try:
+                        file_size = track['size_bytes'] or os.path.getsize(file_path)
+                        os.remove(file_path)
+
+                        deleted_names.append(file_name)
+                        deleted_bytes_total += file_size
+                        logging.info(f"CLEANUP: Deleted '{file_name}' ({file_size / (1024**2):.2f} MB)")
+                    except Exception as e:
+                        logging.error(f"CLEANUP: Error deleting file {file_name}: {e}")
+
+            evict_cursor.close()
+
+            if deleted_names:
+                cursor.execute("DELETE FROM tracks WHERE file_name = ANY(%s)", (deleted_names,))
+                cursor.execute("UPDATE cache_stats SET total_bytes = GREATEST(total_bytes - %s, 0)", (deleted_bytes_total,))
+                conn.commit()
 
-                    deleted_bytes_total += file_size
-                    deleted_files_count += 1
-                    logging.info(f"CLEANUP: Deleted '{file_name}' ({file_size / (1024**2):.2f} MB)")
-                except Exception as e:
-                    logging.error(f"CLEANUP: Error deleting file {file_name}: {e}")
-        
-        cursor.close()
-        return_db_connection(conn)
-        logging.info(f"CLEANUP: Finished. Deleted {deleted_files_count} files, freeing {deleted_bytes_total / (1024**2):.2f} MB.")
+            cursor.close()
+            logging.info(f"CLEANUP: Finished. Deleted {len(deleted_names)} files, freeing {deleted_bytes_total / (1024**2):.2f} MB.")
     except Exception as e:
         logging.error(f"CLEANUP: An unexpected error occurred during cleanup: {e}", exc_info=True)
     finally:
@@ -176,11 +298,12 @@ def download_and_cache_track(search_query, song_name, artist):
     logging.info(f"BACKGROUND: Starting Opus download for '{search_query}'")
     conn = None
     try:
-        conn = psycopg2.connect(dsn=settings.NEON_CONNECTION_STRING)
+        conn = db_connection_pool.getconn()
         cursor = conn.cursor()
-        unique_filename = f"{uuid.uuid4()}.opus"
-        final_filepath = os.path.join(MUSIC_DIRECTORY, unique_filename)
-        temp_output_path = os.path.join(MUSIC_DIRECTORY, os.path.splitext(unique_filename)[0])
+        uid = uuid.uuid4().hex
+        unique_filename = uid + '.opus'
+        temp_output_path = os.path.join(MUSIC_DIRECTORY, uid)
+        final_filepath = temp_output_path + '.opus'
         
         ydl_opts = {
             'format': 'bestaudio/best',
@@ -201,20 +324,23 @@ def download_and_cache_track(search_query, song_name, artist):
         logging.info(f"BACKGROUND: Renamed downloaded file to {unique_filename}")
 
         audio = Opus(final_filepath)
+        file_size = os.path.getsize(final_filepath)
         update_sql = """
             UPDATE tracks SET status = 'cached', file_name = %s, title = %s, artist = %s,
-                album = %s, duration = %s, cached_at = NOW(), last_accessed_at = NOW() WHERE search_query = %s;
+                album = %s, duration = %s, size_bytes = %s, cached_at = NOW(), last_accessed_at = NOW() WHERE search_query = %s;
         """
-        values = (unique_filename, audio.get('title', [''])[0] or song_name, audio.get('artist', [''])[0] or artist, audio.get('album', [''])[0], audio.info.length, search_query)
+        values = (unique_filename, audio.get('title', [''])[0] or song_name, audio.get('artist', [''])[0] or artist, audio.get('album', [''])[0], audio.info.length, file_size, search_query)
         cursor.execute(update_sql, values)
+        cursor.execute("UPDATE cache_stats SET total_bytes = total_bytes + %s", (file_size,))
         conn.commit()
         logging.info(f"BACKGROUND: Successfully cached '{search_query}' as {unique_filename}")
 
-        threading.Thread(target=cleanup_cache).start()
+        background_executor.submit(cleanup_cache)
     except Exception as e:
         logging.error(f"BACKGROUND ERROR: Failed to download '{search_query}': {e}", exc_info=True)
         if conn:
             try:
+                conn.rollback()
                 error_sql = "UPDATE tracks SET status = 'error' WHERE search_query = %s;"
                 cursor.execute(error_sql, (search_query,))
                 conn.commit()
@@ -223,7 +349,7 @@ def download_and_cache_track(search_query, song_name, artist):
     finally:
         if conn:
             cursor.close()
-            conn.close()
+            db_connection_pool.putconn(conn)
 
 # ==============================================================================
 # --- 4. API ENDPOINTS ---
@@ -231,10 +357,9 @@ def download_and_cache_track(search_query, song_name, artist):
 @app.route('/api/now-playing', methods=['GET'])
 @require_api_key
 def get_now_playing():
-    conn = None
     try:
         access_token = get_spotify_access_token()
-        response = requests.get(NOW_PLAYING_ENDPOINT, headers={'Authorization': f'Bearer {access_token}'})
+        response = spotify_session.get(NOW_PLAYING_ENDPOINT, headers={'Authorization': f'Bearer {access_token}'}, timeout=SPOTIFY_TIMEOUT)
         response_timestamp = time.time()
         if response.status_code == 204 or not response.content:
             return jsonify({"status": "not_playing"})
@@ -253,30 +378,45 @@ def get_now_playing():
             "timestamp": response_timestamp
         }
 
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT file_name, status FROM tracks WHERE search_query = %s", (search_query,))
-        result = cursor.fetchone()
-
-        file_is_missing = False
-        if result and result['status'] == 'cached':
-            if not result['file_name'] or not os.path.exists(os.path.join(MUSIC_DIRECTORY, result['file_name'])):
-                logging.warning(f"File for cached track '{search_query}' is missing. Triggering re-download.")
-                file_is_missing = True
-
-        if not result or file_is_missing:
-            track_info["status"] = "caching"
-            if file_is_missing:
-                cursor.execute("UPDATE tracks SET status = 'caching', file_name = NULL WHERE search_query = %s", (search_query,))
-            else:
-                insert_sql = "INSERT INTO tracks (search_query, status) VALUES (%s, 'caching') ON CONFLICT (search_query) DO NOTHING;"
-                cursor.execute(insert_sql, (search_query,))
+        with db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            # Single round-trip: insert the row if the track is new, otherwise
+            # return the existing one, so the common poll path needs no
+            # follow-up write.
+            cursor.execute("""
+                WITH upsert AS (
+                    INSERT INTO tracks (search_query, status) VALUES (%s, 'caching')
+                    ON CONFLICT (search_query) DO NOTHING
+                    RETURNING status, file_name, TRUE AS inserted
+                )
+                SELECT status, file_name, inserted FROM upsert
+                UNION ALL
+                SELECT status, file_name, FALSE FROM tracks WHERE search_query = %s
+                LIMIT 1
+            """, (search_query, search_query))
+            result = cursor.fetchone()
             conn.commit()
-            download_thread = threading.Thread(target=download_and_cache_track, args=(search_query, title_str, artist_str))
-            download_thread.start()
-        else:
+
+            needs_download = result['inserted']
             track_info["status"] = result['status']
-            
+
+            if not needs_download and result['status'] == 'cached':
+                if not result['file_name'] or not os.path.exists(os.path.join(MUSIC_DIRECTORY, result['file_name'])):
+                    logging.warning(f"File for cached track '{search_query}' is missing. Triggering re-download.")
+                    # The bytes are already gone from disk; keep the running
+                    # total honest before the re-download adds the new size.
+                    cursor.execute("""
+                        UPDATE cache_stats SET total_bytes = GREATEST(total_bytes -
+                            COALESCE((SELECT size_bytes FROM tracks WHERE search_query = %s), 0), 0)
+                    """, (search_query,))
+                    cursor.execute("UPDATE tracks SET status = 'caching', file_name = NULL, size_bytes = NULL WHERE search_query = %s", (search_query,))
+                    conn.commit()
+                    needs_download = True
+
+            if needs_download:
+                track_info["status"] = "caching"
+                background_executor.submit(download_and_cache_track, search_query, title_str, artist_str)
+
         return jsonify(track_info)
     except requests.exceptions.RequestException as e:
         logging.error(f"Error communicating with Spotify: {e}")
@@ -287,26 +427,29 @@ def get_now_playing():
     except Exception as e:
         logging.error(f"An unexpected error occurred in get_now_playing: {e}", exc_info=True)
         return jsonify({"error": "An internal server error occurred."}), 500
-    finally:
-        if conn: return_db_connection(conn)
 
 @app.route('/api/tracks', methods=['GET'])
 @require_api_key
 def list_tracks():
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT file_name, title, artist, album, duration FROM tracks WHERE status = 'cached' ORDER BY cached_at DESC")
-        tracks = [dict(row) for row in cursor.fetchall()]
-        for track in tracks:
-            track['fileName'] = track.pop('file_name')
-        return jsonify(tracks)
-    except psycopg2.Error as err:
-        logging.error(f"Database error: {err}")
-        return jsonify({"error": "Could not retrieve tracks."}), 500
-    finally:
-        if conn: return_db_connection(conn)
+    def generate():
+        # Server-side cursor + generator: rows are serialized and sent as they
+        # arrive instead of materializing the whole track list in memory.
+        try:
+            with db_conn() as conn:
+                cursor = conn.cursor(name='tracks_cur', cursor_factory=DictCursor)
+                cursor.itersize = 256
+                cursor.execute("SELECT file_name AS \"fileName\", title, artist, album, duration FROM tracks WHERE status = 'cached' ORDER BY cached_at DESC")
+                yield '['
+                first = True
+                for row in cursor:
+                    yield ('' if first else ',') + json.dumps(dict(row), default=str)
+                    first = False
+                cursor.close()
+                yield ']'
+        except psycopg2.Error as err:
+            logging.error(f"Database error: {err}")
+            raise
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -321,12 +464,11 @@ def get_streamable_track():
     if not all([isinstance(song_name, str), isinstance(artist, str), song_name.strip(), artist.strip()]):
         return jsonify({"error": "'song_name' and 'artist' must be non-empty strings."}), 400
     search_query = f"{artist.lower().strip()} - {song_name.lower().strip()}"
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT file_name FROM tracks WHERE search_query = %s AND status = 'cached'", (search_query,))
-        result = cursor.fetchone()
+        with db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=DictCursor)
+            cursor.execute("SELECT file_name FROM tracks WHERE search_query = %s AND status = 'cached'", (search_query,))
+            result = cursor.fetchone()
         if result and os.path.exists(os.path.join(MUSIC_DIRECTORY, result['file_name'])):
             return jsonify({"message": "Track is ready.", "stream_url": f"/api/stream/{result['file_name']}"})
         else:
@@ -334,52 +476,33 @@ def get_streamable_track():
     except psycopg2.Error as err:
         logging.error(f"Database error in play: {err}")
         return jsonify({"error": "A database error occurred."}), 500
-    finally:
-        if conn: return_db_connection(conn)
 
 @app.route('/api/stream/<string:file_name>')
 @require_api_key
 def stream_track(file_name):
-    music_file_path = os.path.join(MUSIC_DIRECTORY, file_name)
-    if not os.path.abspath(music_file_path).startswith(os.path.abspath(MUSIC_DIRECTORY)):
+    if not _FILENAME_RE.match(file_name):
         abort(403, "Access denied.")
-    if not os.path.exists(music_file_path):
+    music_file_path = os.path.join(MUSIC_DIRECTORY, file_name)
+    # One stat() covers the existence check, the regular-file check, and the
+    # mtime handed to send_file below.
+    try:
+        st = os.stat(music_file_path)
+    except OSError:
+        abort(404, "Track not found in cache.")
+    if not stat.S_ISREG(st.st_mode):
         abort(404, "Track not found in cache.")
     
-    def update_access_time():
-        conn = None
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE tracks SET last_accessed_at = NOW() WHERE file_name = %s", (file_name,))
-            conn.commit()
-            cursor.close()
-        except Exception as e:
-            logging.error(f"Error updating access time for {file_name}: {e}")
-        finally:
-            if conn: return_db_connection(conn)
-    threading.Thread(target=update_access_time).start()
-    
-    range_header, file_size = request.headers.get('Range', None), os.path.getsize(music_file_path)
-    if not range_header:
-        return send_file(music_file_path, mimetype='audio/opus')
-    start, end = 0, file_size - 1
-    match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-    if match:
-        start = int(match.groups()[0])
-        if match.groups()[1]: end = int(match.groups()[1])
-    if start >= file_size or end >= file_size:
-        abort(416, "Requested Range Not Satisfiable")
-    length = (end - start) + 1
-    def generate_chunks():
-        with open(music_file_path, 'rb') as f:
-            f.seek(start)
-            yield f.read(length)
-    resp = Response(generate_chunks(), 206, mimetype='audio/opus', direct_passthrough=True)
-    resp.headers.add('Content-Range', f'bytes {start}-{end}/{file_size}')
-    resp.headers.add('Accept-Ranges', 'bytes')
-    resp.headers.add('Content-Length', str(length))
-    return resp
+    # Record the access in the buffer; the flusher thread batches these into
+    # one UPDATE every few seconds, so reconnects/seeks cost no round-trips.
+    with _access_buf_lock:
+        _access_buf[file_name] = datetime.now(timezone.utc)
+
+
+    # conditional=True makes Werkzeug handle Range/If-Range itself (206, 416,
+    # Content-Range) and serve the file through wsgi.file_wrapper, which uses
+    # sendfile(2) where available instead of copying chunks through Python.
+    return send_file(music_file_path, mimetype='audio/opus', conditional=True,
+                     etag=True, last_modified=st.st_mtime)
 
 # ==============================================================================
 # --- 5. MAIN EXECUTION BLOCK ---
@@ -388,4 +511,9 @@ if __name__ == '__main__':
     if not os.path.exists(MUSIC_DIRECTORY):
         os.makedirs(MUSIC_DIRECTORY)
         logging.info(f"Music directory created at: {MUSIC_DIRECTORY}")
+    # The single-threaded Werkzeug dev server serializes streaming responses;
+    # production runs under gunicorn (see gunicorn.conf.py).
+    if os.environ.get('FLASK_DEV') != '1':
+        logging.critical("FATAL: Refusing to start the Werkzeug dev server. Run 'gunicorn --config gunicorn.conf.py main:app', or set FLASK_DEV=1 for local development.")
+        exit(1)
     app.run(debug=True, port=4000)
\ No newline at end of file